@@ -3,9 +3,23 @@ Excel MCP Agent 配置加载器
 简洁的配置管理，基于工厂模式设计思想
 """
 import yaml
+try:
+    # 优先使用 libyaml 的 C 实现，解析速度比纯 Python 实现快数倍
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 import os
-from typing import Dict, Any
-from openai import OpenAI
+import hashlib
+import pickle
+import time
+from typing import Dict, Any, Optional
+
+
+# 解析结果缓存目录（按配置文件的 mtime+size 失效）
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "excel_agent")
+
+# 自动解析出的模型名的磁盘缓存 TTL：模型服务的部署很少变，1 小时内免网络往返
+_MODEL_NAME_TTL = 3600
 
 
 class ConfigLoader:
@@ -20,14 +34,54 @@ class ConfigLoader:
         """
         self.config_file = config_file
         self._config = self._load_config()
+        # 已解析模型名缓存：避免重复的 models.list() HTTP 往返
+        self._resolved_model_name: Dict[str, str] = {}
+        # OpenAI 客户端池：按 (base_url, api_key) 复用连接，省掉重复 TCP/TLS 握手
+        self._openai_clients: Dict[tuple, Any] = {}
     
     def _load_config(self) -> Dict[str, Any]:
-        """加载配置文件"""
+        """加载配置文件（优先读取 pickle 缓存，避免每次启动重新解析 YAML）"""
         if not os.path.exists(self.config_file):
             raise FileNotFoundError(f"配置文件 {self.config_file} 不存在，请创建该文件并配置相关参数")
-        
-        with open(self.config_file, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+
+        cache_path = self._config_cache_path()
+
+        # 缓存命中：直接反序列化，跳过 YAML 解析
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    return pickle.load(f)
+            except Exception:
+                # 缓存损坏或版本不兼容时回退到 YAML 解析
+                pass
+
+        # 二进制大缓冲区打开，让 libyaml 直接从流中分块读取，省掉一次整体拷贝
+        with open(self.config_file, 'rb', buffering=1 << 20) as f:
+            config = yaml.load(f, Loader=_YamlLoader)
+
+        # 写回缓存（失败不影响主流程）
+        if cache_path:
+            try:
+                os.makedirs(_CACHE_DIR, exist_ok=True)
+                tmp_path = cache_path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(config, f, protocol=5)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+
+        return config
+
+    def _config_cache_path(self) -> Optional[str]:
+        """根据配置文件的 mtime+size 计算缓存文件路径，文件内容变化时自动失效"""
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return None
+        key = hashlib.sha1(
+            f"{os.path.abspath(self.config_file)}:{st.st_mtime_ns}:{st.st_size}".encode()
+        ).hexdigest()
+        return os.path.join(_CACHE_DIR, f"{key}.pkl")
     
 
     
@@ -36,9 +90,11 @@ class ConfigLoader:
         """获取 MCP 服务器配置"""
         return self._config["mcp_server"]
     
-    def get_model_service_config(self, model: str) -> Dict[str, Any]:
-        """获取指定模型的服务配置"""
+    def get_model_service_config(self, model: Optional[str] = None) -> Dict[str, Any]:
+        """获取指定模型的服务配置，不指定时取配置中的第一个模型"""
         model_service = self._config["model_service"]
+        if model is None:
+            model = next(iter(model_service))
         if model not in model_service:
             raise KeyError(f"模型 '{model}' 不存在于配置中，可用模型: {list(model_service.keys())}")
         return model_service[model]
@@ -48,30 +104,139 @@ class ConfigLoader:
         """获取代理配置"""
         return self._config["agent_config"]
     
-    def get_model_name(self, model: str) -> str:
-        """获取指定模型的名称"""
+    @staticmethod
+    def _pick_model_id(ids: list) -> str:
+        """从可用模型 id 中选择：优先量化版（int8/fp8/AWQ 权重带宽减半，
+        解码吞吐通常翻倍），否则取第一个"""
+        quant_markers = ("awq", "fp8", "int8", "gptq")
+        return next(
+            (i for i in ids if any(q in i.lower() for q in quant_markers)),
+            ids[0]
+        )
+
+    @staticmethod
+    def _model_name_cache_path(model_config: Dict[str, Any]) -> str:
+        """模型名磁盘缓存路径（按服务 base_url 区分）"""
+        key = hashlib.sha1(model_config["base_url"].encode()).hexdigest()
+        return os.path.join(_CACHE_DIR, f"model_name_{key}.txt")
+
+    @staticmethod
+    def _read_model_name_cache(cache_path: str) -> Optional[str]:
+        """读取 TTL 内的模型名磁盘缓存，缺失/过期/为空时返回 None"""
+        try:
+            if time.time() - os.path.getmtime(cache_path) < _MODEL_NAME_TTL:
+                with open(cache_path) as f:
+                    name = f.read().strip()
+                if name:
+                    return name
+        except OSError:
+            pass
+        return None
+
+    @staticmethod
+    def _write_model_name_cache(cache_path: str, name: str) -> None:
+        """原子写回模型名磁盘缓存（失败不影响主流程）"""
+        try:
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(name)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+    def get_model_name(self, model: Optional[str] = None) -> str:
+        """获取指定模型的名称（进程内 + 磁盘两级缓存，避免重复请求模型服务）"""
+        cache_key = model if model is not None else "__default__"
+        if cache_key in self._resolved_model_name:
+            return self._resolved_model_name[cache_key]
+
         model_config = self.get_model_service_config(model)
-        
+
         # 如果配置中指定了模型名称，直接返回
         if model_config.get("model_name"):
+            self._resolved_model_name[cache_key] = model_config["model_name"]
             return model_config["model_name"]
-        
+
         # 如果启用自动获取第一个模型
         if model_config.get("auto_get_first_model", True):
+            # 磁盘缓存 TTL 内直接复用上次解析结果，冷启动零网络往返
+            disk_path = self._model_name_cache_path(model_config)
+            cached = self._read_model_name_cache(disk_path)
+            if cached:
+                self._resolved_model_name[cache_key] = cached
+                return cached
+
+            # 延迟导入：openai 的导入链（httpx/anyio 等）较重，
+            # 配置了 model_name 的调用路径完全不需要它
+            from openai import OpenAI
+
             try:
-                client = OpenAI(
-                    base_url=model_config["base_url"],
-                    api_key=model_config["api_key"]
-                )
+                client_key = (model_config["base_url"], model_config["api_key"])
+                client = self._openai_clients.get(client_key)
+                if client is None:
+                    client = OpenAI(
+                        base_url=model_config["base_url"],
+                        api_key=model_config["api_key"]
+                    )
+                    self._openai_clients[client_key] = client
                 models = client.models.list()
                 if models.data:
-                    return models.data[0].id
+                    chosen = self._pick_model_id([m.id for m in models.data])
+                    self._resolved_model_name[cache_key] = chosen
+                    self._write_model_name_cache(disk_path, chosen)
+                    return chosen
                 else:
                     raise Exception("没有可用的模型")
             except Exception as e:
                 print(f"❌ 获取模型名称失败: {e}")
                 raise
-        
+
+        raise Exception("无法获取模型名称，请检查配置")
+
+    async def aget_model_name(self, model: Optional[str] = None) -> str:
+        """get_model_name 的异步变体：在事件循环内解析模型名时不阻塞
+
+        命中进程内/磁盘缓存时无 I/O；未命中时用 httpx.AsyncClient 直接
+        GET /models，不经过同步的 openai 客户端。
+        """
+        cache_key = model if model is not None else "__default__"
+        if cache_key in self._resolved_model_name:
+            return self._resolved_model_name[cache_key]
+
+        model_config = self.get_model_service_config(model)
+
+        if model_config.get("model_name"):
+            self._resolved_model_name[cache_key] = model_config["model_name"]
+            return model_config["model_name"]
+
+        if model_config.get("auto_get_first_model", True):
+            disk_path = self._model_name_cache_path(model_config)
+            cached = self._read_model_name_cache(disk_path)
+            if cached:
+                self._resolved_model_name[cache_key] = cached
+                return cached
+
+            import httpx
+
+            try:
+                async with httpx.AsyncClient(
+                    base_url=model_config["base_url"],
+                    headers={"Authorization": f"Bearer {model_config['api_key']}"}
+                ) as client:
+                    resp = await client.get("/models")
+                    resp.raise_for_status()
+                    data = resp.json().get("data") or []
+                if not data:
+                    raise Exception("没有可用的模型")
+                chosen = self._pick_model_id([m["id"] for m in data])
+                self._resolved_model_name[cache_key] = chosen
+                self._write_model_name_cache(disk_path, chosen)
+                return chosen
+            except Exception as e:
+                print(f"❌ 获取模型名称失败: {e}")
+                raise
+
         raise Exception("无法获取模型名称，请检查配置")
     
     def get_mcp_client_config(self) -> Dict[str, Dict[str, Any]]:
@@ -80,11 +245,39 @@ class ConfigLoader:
         return {
             mcp_config["name"]: {
                 "transport": mcp_config["transport"],
-                "url": mcp_config["url"]
+                "url": mcp_config["url"],
+                # 自定义 httpx 工厂：长连接池（h2 可用时走 HTTP/2 多路复用），
+                # 多次工具调用不再各自重做 TCP/TLS 握手
+                "httpx_client_factory": _mcp_httpx_client_factory,
             }
         }
 
 
+def _mcp_httpx_client_factory(headers: Optional[Dict[str, str]] = None,
+                              timeout: Any = None,
+                              auth: Any = None) -> Any:
+    """为 MCP streamable_http 传输构建带连接池的 httpx 客户端
+
+    与 mcp 库默认工厂的差异：显式的 keep-alive 连接池上限，以及在安装了
+    h2 的环境下启用 HTTP/2 多路复用——同一条连接承载整个工作流的全部
+    tools/call 请求，省掉 (N-1) 次 TCP/TLS 握手。
+    """
+    import httpx
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        headers=headers,
+        timeout=timeout if timeout is not None else httpx.Timeout(30.0),
+        auth=auth,
+        follow_redirects=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+    )
+
+
 # 全局配置实例（单例模式）
 _config_loader = None
 
@@ -103,7 +296,7 @@ def get_mcp_server_config() -> Dict[str, Any]:
     return get_config_loader().mcp_server_config
 
 
-def get_model_service_config(model: str) -> Dict[str, Any]:
+def get_model_service_config(model: Optional[str] = None) -> Dict[str, Any]:
     """获取指定模型的服务配置"""
     return get_config_loader().get_model_service_config(model)
 
@@ -113,11 +306,48 @@ def get_agent_config() -> Dict[str, Any]:
     return get_config_loader().agent_config
 
 
-def get_model_name(model: str) -> str:
+def get_model_name(model: Optional[str] = None) -> str:
     """获取指定模型的名称"""
     return get_config_loader().get_model_name(model)
 
 
+async def aget_model_name(model: Optional[str] = None) -> str:
+    """获取指定模型的名称（异步变体，事件循环内使用）"""
+    return await get_config_loader().aget_model_name(model)
+
+
 def get_mcp_client_config() -> Dict[str, Dict[str, Any]]:
     """获取 MCP 客户端配置"""
-    return get_config_loader().get_mcp_client_config() 
\ No newline at end of file
+    return get_config_loader().get_mcp_client_config()
+
+
+# 共享的 ChatOpenAI 实例池（按模型区分）：长驻进程里反复构建 LLM 会重复
+# 创建 httpx 连接池并重做 TLS 握手，这里按模型只建一次并复用
+_llm_instances: Dict[str, Any] = {}
+
+
+def get_llm(model: Optional[str] = None) -> Any:
+    """获取共享的 ChatOpenAI 实例（同一模型复用同一个 httpx 连接池）"""
+    cache_key = model if model is not None else "__default__"
+    llm = _llm_instances.get(cache_key)
+    if llm is None:
+        # 延迟导入：只有真正需要 LLM 的脚本才付出 langchain/httpx 的导入开销
+        import httpx
+        from langchain_openai import ChatOpenAI
+        from pydantic import SecretStr
+
+        loader = get_config_loader()
+        model_config = loader.get_model_service_config(model)
+        llm = ChatOpenAI(
+            base_url=model_config["base_url"],
+            api_key=SecretStr(model_config["api_key"]),
+            model=loader.get_model_name(model),
+            temperature=model_config.get("temperature", 0),
+            # vLLM：显式开启 prompt 前缀缓存，系统提示词的 prefill 只算一次
+            extra_body={"cache_prompt": True},
+            http_async_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            ),
+        )
+        _llm_instances[cache_key] = llm
+    return llm
\ No newline at end of file
@@ -1,9 +1,9 @@
+import json
 from typing import Optional, List, Dict, Any, Union
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from enum import Enum
 from langchain_core.messages import (
-    BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage,
-    messages_from_dict, messages_to_dict, message_to_dict, convert_to_messages, convert_to_openai_messages
+    BaseMessage, HumanMessage, message_to_dict, convert_to_messages
 )
 
 
@@ -17,6 +17,9 @@ class MessageRole(str, Enum):
 
 class ToolCall(BaseModel):
     """工具调用信息"""
+    # 固定字段布局：冻结 + 禁止额外字段，减少每实例内存并避免意外写入
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     id: str = Field(..., description="工具调用ID")
     name: str = Field(..., description="工具名称")
     type: str = Field(default="function", description="工具类型")
@@ -25,6 +28,8 @@ class ToolCall(BaseModel):
 
 class TokenUsage(BaseModel):
     """Token使用统计"""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     input_tokens: Optional[int] = None
     output_tokens: Optional[int] = None
     total_tokens: Optional[int] = None
@@ -32,6 +37,8 @@ class TokenUsage(BaseModel):
 
 class MessageMetadata(BaseModel):
     """消息元数据"""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     model_name: Optional[str] = None
     finish_reason: Optional[str] = None
     token_usage: Optional[TokenUsage] = None
@@ -39,6 +46,8 @@ class MessageMetadata(BaseModel):
 
 class ChatMessage(BaseModel):
     """聊天消息模型"""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     role: MessageRole = Field(..., description="消息角色")
     content: Optional[str] = Field(default="", description="消息文本内容")
     
@@ -86,51 +95,91 @@ class ChatResponse(BaseModel):
 
 # 消息转换工具函数
 
+# LangChain 消息类型 → MessageRole 的映射（模块级常量，避免热路径上重复建字典）
+_LC_TO_ROLE = {
+    "ai": MessageRole.ASSISTANT,
+    "human": MessageRole.USER,
+    "system": MessageRole.SYSTEM,
+    "tool": MessageRole.TOOL
+}
+
+
+def _chat_message_to_openai_dict(msg: ChatMessage, json_args: bool = True) -> Dict[str, Any]:
+    """
+    将单条 ChatMessage 一次性转换为 OpenAI API 格式字典
+
+    Args:
+        msg: ChatMessage 对象
+        json_args: 是否把工具调用参数序列化为 JSON 字符串。OpenAI 线上
+            格式要求 function.arguments 是字符串；LangChain 的
+            convert_to_messages 字符串和 dict 都接受，传 False 可以
+            省掉一次 dumps/loads 往返
+
+    Returns:
+        OpenAI API 格式的消息字典
+    """
+    msg_dict: Dict[str, Any] = {
+        "role": msg.role.value,  # MessageRole enum 转为字符串
+        "content": msg.content or ""
+    }
+
+    # 处理工具调用（AI消息）
+    if msg.tool_calls:
+        msg_dict["tool_calls"] = [
+            {
+                "id": tc.id,
+                "type": tc.type,
+                "function": {
+                    "name": tc.name,
+                    "arguments": (
+                        json.dumps(tc.args or {}, ensure_ascii=False)
+                        if json_args else tc.args
+                    )
+                }
+            }
+            for tc in msg.tool_calls
+        ]
+
+    # 处理工具消息的 tool_call_id
+    if msg.tool_call_id:
+        msg_dict["tool_call_id"] = msg.tool_call_id
+
+    return msg_dict
+
+
 def chat_request_to_langchain_messages(chat_request: ChatRequest) -> List[BaseMessage]:
     """
     将 ChatRequest 转换为 LangChain BaseMessage 列表
-    
+
     Args:
         chat_request: 用户请求对象
-        
+
     Returns:
         LangChain BaseMessage 列表
     """
-    # 转换为字典格式，符合 OpenAI API 标准
-    message_dicts = []
-    
-    for msg in chat_request.messages:
-        msg_dict = {
-            "role": msg.role.value,  # MessageRole enum 转为字符串
-            "content": msg.content or ""
-        }
-        
-        # 处理工具调用（AI消息）
-        if msg.tool_calls:
-            msg_dict["tool_calls"] = [
-                {
-                    "id": tc.id,
-                    "type": tc.type,
-                    "function": {
-                        "name": tc.name,
-                        "arguments": tc.args
-                    }
-                }
-                for tc in msg.tool_calls
-            ]
-        
-        # 处理工具消息的 tool_call_id
-        if msg.tool_call_id:
-            msg_dict["tool_call_id"] = msg.tool_call_id
-            
-        # 添加消息ID
+    # 预分配输出列表；convert_to_messages 接受 BaseMessage 与 dict 混合输入，
+    # BaseMessage 会原样透传
+    src_messages = chat_request.messages
+    out: List[Any] = [None] * len(src_messages)
+
+    for i, msg in enumerate(src_messages):
+        # 快路径：最常见的纯文本用户消息直接构造，跳过 dict 往返
+        if msg.role is MessageRole.USER and not msg.tool_calls:
+            out[i] = HumanMessage(content=msg.content or "", id=msg.message_id)
+            continue
+
+        # 慢路径：转换为字典格式，符合 OpenAI API 标准
+        # （LangChain 路径参数保持 dict，免去字符串往返）
+        msg_dict: Dict[str, Any] = _chat_message_to_openai_dict(msg, json_args=False)
+
+        # 添加消息ID（仅 LangChain 路径需要）
         if msg.message_id:
             msg_dict["id"] = msg.message_id
-            
-        message_dicts.append(msg_dict)
-    
+
+        out[i] = msg_dict
+
     # 使用官方转换器，自动处理 role 映射和工具调用解析
-    return convert_to_messages(message_dicts)
+    return convert_to_messages(out)
 
 
 def langchain_messages_to_chat_response(
@@ -156,57 +205,51 @@ def langchain_messages_to_chat_response(
     last_message = messages[-1]
     
     # 使用官方转换器获取消息字典
-    msg_dict = message_to_dict(last_message)
-    msg_data = msg_dict["data"]
-    
-    # 角色映射
-    role_mapping = {
-        "ai": MessageRole.ASSISTANT,
-        "human": MessageRole.USER, 
-        "system": MessageRole.SYSTEM,
-        "tool": MessageRole.TOOL
-    }
+    msg_dict: Dict[str, Any] = message_to_dict(last_message)
+    msg_data: Dict[str, Any] = msg_dict["data"]
     
     # 转换工具调用
-    tool_calls = None
+    # 数据来自 LangChain 消息对象，结构已知合法，用 model_construct 跳过
+    # Pydantic 校验开销；校验只保留在对外入口（ChatRequest）
+    tool_calls: Optional[List[ToolCall]] = None
     if msg_data.get("tool_calls"):
         tool_calls = [
-            ToolCall(
+            ToolCall.model_construct(
                 id=tc["id"],
-                name=tc["name"], 
+                name=tc["name"],
                 type=tc.get("type", "function"),
                 args=tc["args"]
             )
             for tc in msg_data["tool_calls"]
         ]
-    
+
     # 处理 token 使用情况
-    token_usage = None
+    token_usage: Optional[TokenUsage] = None
     if usage_meta := msg_data.get("usage_metadata"):
-        token_usage = TokenUsage(
+        token_usage = TokenUsage.model_construct(
             input_tokens=usage_meta.get("input_tokens"),
-            output_tokens=usage_meta.get("output_tokens"), 
+            output_tokens=usage_meta.get("output_tokens"),
             total_tokens=usage_meta.get("total_tokens")
         )
-    
+
     # 构建元数据
-    metadata = MessageMetadata(
+    metadata = MessageMetadata.model_construct(
         model_name=model_name,
         finish_reason=msg_data.get("response_metadata", {}).get("finish_reason"),
         token_usage=token_usage
     )
-    
+
     # 构建响应消息
-    response_message = ChatMessage(
-        role=role_mapping.get(msg_dict["type"], MessageRole.ASSISTANT),
+    response_message = ChatMessage.model_construct(
+        role=_LC_TO_ROLE.get(msg_dict["type"], MessageRole.ASSISTANT),
         content=msg_data.get("content", ""),
         tool_calls=tool_calls,
-        tool_call_id=msg_data.get("tool_call_id"), 
+        tool_call_id=msg_data.get("tool_call_id"),
         metadata=metadata,
         message_id=msg_data.get("id")
     )
-    
-    return ChatResponse(
+
+    return ChatResponse.model_construct(
         message=response_message,
         **kwargs
     )
@@ -222,12 +265,7 @@ def chat_messages_to_openai_format(chat_messages: List[ChatMessage]) -> List[Dic
     Returns:
         OpenAI API 格式的消息列表
     """
-    # 先转为 LangChain Messages
-    lc_messages = chat_request_to_langchain_messages(
-        ChatRequest(messages=chat_messages)
-    )
-    
-    # 再转为 OpenAI 格式
-    return convert_to_openai_messages(lc_messages)
+    # 直接一次成型，跳过「dict → LangChain 对象 → dict」的往返转换
+    return [_chat_message_to_openai_dict(msg) for msg in chat_messages]
 
 
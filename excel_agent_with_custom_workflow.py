@@ -1,68 +1,33 @@
 # excel_agent_with_custom_workflow.py
 import asyncio
-from typing import TypedDict, List, Dict, Any, Union, Annotated
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain_mcp_adapters.tools import load_mcp_tools
-from langchain_openai import ChatOpenAI
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, BaseMessage, SystemMessage
 from langchain_core.tools import BaseTool
-from langgraph.graph import StateGraph, END, add_messages
-from langgraph.prebuilt import ToolNode
-from pydantic import SecretStr
-from pydantic.type_adapter import P
-from config_loader import get_model_service_config, get_model_name, get_mcp_client_config, get_agent_config
+try:
+    # 可选依赖：C 实现的 JSON 序列化，大的 Excel 结果能快 5-10 倍且产物更紧凑
+    import orjson
+except ImportError:
+    orjson = None
+from config_loader import (
+    get_llm, get_mcp_client_config, get_mcp_server_config, get_agent_config,
+)
+from mcp_tools_cache import load_mcp_tools_cached
+from read_call_parser import parse_read_call
 
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
 
-class AgentState(TypedDict):
-    """代理状态定义"""
-    messages: Annotated[List[BaseMessage], add_messages]
-    iteration_count: int
-    max_iterations: int
+# 迭代过程的调试输出走 logger：print 同步刷 stdout，在容器/管道环境下
+# 每次 flush 都是一次阻塞事件循环的系统调用；DEBUG 关闭时几乎零开销
+logger = logging.getLogger(__name__)
 
 
-class ExcelWorkflowAgent:
-    """使用 LangGraph 工作流编排的 Excel 代理"""
-    
-    def __init__(self, llm: ChatOpenAI, tools: List[BaseTool]):
-        self.llm = llm
-        self.tools = tools
-        self.tool_node = ToolNode(tools)
-        self.workflow = self._create_workflow()
-    
-    def _create_workflow(self):
-        """创建工作流程图"""
-        workflow = StateGraph(AgentState)
-        
-        # 添加节点
-        workflow.add_node("agent", self._agent_node)
-        workflow.add_node("action", self._action_node)
-        workflow.add_node("finish", self._finish_node)
-        
-        # 设置入口点
-        workflow.set_entry_point("agent")
-        
-        # 添加条件边
-        workflow.add_conditional_edges(
-            "agent",
-            self._should_continue,
-            {
-                "continue": "action",
-                "finish": "finish"
-            }
-        )
-        
-        # 添加边
-        workflow.add_edge("action", "agent")
-        workflow.add_edge("finish", END)
-        
-        return workflow.compile()
-    
-    async def _agent_node(self, state: AgentState) -> AgentState:
-        """代理节点：决定下一步行动"""
-        print(f"🤖 代理思考中... (第 {state['iteration_count'] + 1} 次迭代)")
-        
-        # 构建系统消息
-        system_prompt = """你是一个专业的Excel数据分析师和自动化专家。作为一个高级数据分析代理，你具备以下核心能力和职责：
+# 系统提示词：内容固定，提升为模块常量，避免每次迭代重建大字符串
+_SYSTEM_PROMPT = """你是一个专业的Excel数据分析师和自动化专家。作为一个高级数据分析代理，你具备以下核心能力和职责：
 
 ## 核心身份与职责
 你是用户的专业数据分析伙伴，专精于Excel文件的深度分析、数据洞察挖掘和业务价值发现。你的使命是通过精确的数据处理和深入的分析，为用户提供可操作的商业洞察。
@@ -118,224 +83,688 @@ class ExcelWorkflowAgent:
 
 
 """
+
+
+# JSON 解析统一走 orjson（可用时）：流式工具参数和规划器输出的解析都比 stdlib 快数倍；
+# orjson.JSONDecodeError 是 ValueError 子类，调用方的异常处理不用改
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _format_tool_call(tc: Dict[str, Any]) -> str:
+    """把单个 tool_call 格式化成日志文本（name/args/id 各只取一次）"""
+    args = tc.get('args', {})
+    if orjson is not None:
+        try:
+            args_text = orjson.dumps(args, default=str).decode()
+        except TypeError:
+            args_text = str(args)
+    else:
+        args_text = str(args)
+    return f"{tc.get('name', 'unknown')}({args_text}) id={tc.get('id', 'no-id')}"
+
+
+def _dump_tool_content(result: Any) -> str:
+    """把工具返回值序列化成回传给 LLM 的文本
+
+    优先用 orjson：比 str() 的 repr 输出快得多，且 JSON 比 repr 更紧凑，
+    能直接减少回灌到 LLM 的 token 数；orjson 不可用或对象不可序列化时回退 str()。
+    """
+    if isinstance(result, str):
+        return result
+    if orjson is not None:
+        try:
+            return orjson.dumps(result, default=str).decode()
+        except TypeError:
+            pass
+    return str(result)
+
+
+# 规划器提示词：让模型一次性产出工具调用 DAG，独立调用按层并发执行
+_PLANNER_PROMPT = """你是一个任务规划器。根据用户请求和可用工具，输出一个 JSON 数组形式的工具调用计划。
+
+每个元素格式：{"tool": "工具名", "args": {参数}, "depends_on": [依赖的元素下标]}
+- 相互独立的调用不要写依赖，它们会被并发执行
+- 只使用提供的工具名，参数必须完整可执行
+- 如果无法确定完整计划，输出空数组 []
+
+只输出 JSON，不要输出其他内容。
+
+可用工具：
+{tools}
+"""
+
+
+# 历史压缩参数：最近 K 条消息保持原文，更早的大工具结果只保留首尾片段
+_COMPACT_KEEP_LAST = 4
+_COMPACT_HEAD = 300
+_COMPACT_TAIL = 300
+
+# 超过该字节数的工具结果不直接回灌给模型，改走暂存区 + get_blob 按需取回
+_BLOB_THRESHOLD = 4096
+
+
+@dataclass(slots=True)
+class AgentState:
+    """代理状态定义
+
+    槽位 dataclass 而非 TypedDict：属性访问不走 dict 哈希，每条状态
+    也省掉一个 dict 实例的分配（主循环每步都要读写状态）。
+    """
+    messages: List[BaseMessage] = field(default_factory=list)
+    iteration_count: int = 0
+    max_iterations: int = 10
+    # 由 _finish_node 在收尾时写入一次，run() 直接读取，不再重复扫描消息
+    final_answer: Optional[str] = None
+    # 最近一条「无工具调用且有内容」的 AI 消息下标，追加时顺手记录，
+    # 收尾时 O(1) 取用，免去整条历史的反向扫描
+    last_terminal_idx: Optional[int] = None
+    # 流式解码期间提前下发的工具调用任务（按 tool_call id 索引）。
+    # 放在每次运行的状态里而非实例上：run_batch 并发运行时，
+    # 一条查询收尾取消任务不会殃及其他查询的在途任务
+    early_tool_tasks: Dict[str, asyncio.Task] = field(default_factory=dict)
+    # 基于查询文本预判下发的投机任务（按 工具名|规范化参数 索引，跨迭代可复用）
+    spec_tasks: Dict[str, asyncio.Task] = field(default_factory=dict)
+    # 投机读表工具名（None 表示关闭）
+    speculative_tool: Optional[str] = None
+
+
+class ExcelWorkflowAgent:
+    """使用手写异步主循环编排的 Excel 代理"""
+    
+    def __init__(self, llm: "ChatOpenAI", tools: List[BaseTool],
+                 strict_tools: bool = False):
+        self.llm = llm
+        # 大体积工具结果的暂存区：正文留在进程里，只把引用回灌给模型
+        self._blob_store: Dict[str, str] = {}
+        tools = [*tools, self._make_get_blob_tool()]
+        self.tools = tools
+        # 工具名 → 工具对象映射，一次构建，调度时 O(1) 查找
+        self._tools_by_name: Dict[str, BaseTool] = {t.name: t for t in tools}
+        # 工具只绑定一次：bind_tools 每次都会重新包装 Runnable 并序列化工具 schema。
+        # strict_tools 让后端按 JSON schema 约束解码工具参数，杜绝参数格式
+        # 错误引发的重试迭代（需要后端支持 structured outputs，默认关闭）
+        self.llm_with_tools = (
+            llm.bind_tools(tools, strict=True) if strict_tools else llm.bind_tools(tools)
+        )
+        # 系统消息只构建一次（含工具清单），每次迭代直接复用同一个对象；
+        # 工具清单按名称排序，保证前缀跨运行字节级一致，vLLM 前缀缓存才能命中
+        tool_lines = "\n".join(sorted(f"- {t.name}: {t.description}" for t in tools))
+        self._system_message = SystemMessage(
+            content=_SYSTEM_PROMPT + "\n## 可用工具\n" + tool_lines + "\n"
+        )
+
+    async def _agent_node(self, state: AgentState) -> Dict[str, Any]:
+        """代理节点：决定下一步行动"""
+        logger.debug("🤖 代理思考中... (第 %d 次迭代)", state.iteration_count + 1)
+
         # 历史消息长度
-        print(f"历史消息长度(不包含系统消息)：{len(state['messages'])}")
-
-        # 构建消息列表
-        messages = [SystemMessage(content=system_prompt)] + state["messages"]
-        
-        # 调用LLM
-        response = await self.llm.bind_tools(self.tools).ainvoke(messages)
-
-        print("\n┌" + "─"*60 + "┐")
-        print("│" + " "*18 + "📋 模型完整响应" + " "*18 + "│")
-        print("└" + "─"*60 + "┘")
-        print(response)
-
-        # 打印完整的模型响应
-        print("\n╔" + "═"*48 + "╗")
-        print("║" + " "*12 + "🧠 模型响应内容分析" + " "*12 + "║")
-        print("╚" + "═"*48 + "╝")
-        
+        logger.debug("历史消息长度(不包含系统消息)：%d", len(state.messages))
+
+        # 构建消息列表（历史中的旧工具结果先压缩，状态本身不动）
+        messages = [self._system_message, *self._compact_messages(state.messages)]
+
+        # 流式调用 LLM：参数 JSON 已闭合的工具调用立即提前下发，
+        # 让 MCP 工具执行与剩余 token 的解码并行
+        response = None
+        try:
+            async for chunk in self.llm_with_tools.astream(messages):
+                response = chunk if response is None else response + chunk
+                chunk_indexes = [
+                    c.get('index') or 0
+                    for c in (getattr(response, 'tool_call_chunks', None) or [])
+                ]
+                if chunk_indexes:
+                    self._try_dispatch_early(state, response, completed_before=max(chunk_indexes))
+        except ValueError:
+            # 个别后端/模型不产生流式分片，回退到一次性调用
+            response = None
+        if response is None:
+            response = await self.llm_with_tools.ainvoke(messages)
+        # 流结束后，剩余的工具调用全部确定闭合
+        self._try_dispatch_early(state, response)
+
         # 检查是否有工具调用
         tool_calls = getattr(response, 'tool_calls', None)
-        if tool_calls:
-            print("├─ 🔧 模型决定调用工具:")
-            for i, tool_call in enumerate(tool_calls):
-                tool_name = tool_call.get('name', 'unknown')
-                tool_args = tool_call.get('args', {})
-                tool_id = tool_call.get('id', 'no-id')
-                print(f"│  {i+1}. 工具名称: {tool_name}")
-                print(f"│     工具参数: {tool_args}")
-                print(f"│     调用ID: {tool_id}")
-        elif response.content:
-            print("├─ 💬 模型文本响应:")
-            print("│  " + response.content.replace('\n', '\n│  '))
-        else:
-            print("├─ ⚠️ 模型响应为空（无内容且无工具调用）")
-        
 
-        
-        # 检查是否需要继续迭代
-        if tool_calls:
-            print(f"└─ 🔄 将执行 {len(tool_calls)} 个工具调用")
-        else:
-            print("└─ ✅ 模型没有调用工具，准备完成任务")
+        # 响应分析的装饰性输出整块用 isEnabledFor 包住：
+        # DEBUG 关闭时连 f-string 格式化和 content 替换都不会执行
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("\n┌" + "─"*60 + "┐")
+            logger.debug("│" + " "*18 + "📋 模型完整响应" + " "*18 + "│")
+            logger.debug("└" + "─"*60 + "┘")
+            logger.debug("%s", response)
+
+            logger.debug("\n╔" + "═"*48 + "╗")
+            logger.debug("║" + " "*12 + "🧠 模型响应内容分析" + " "*12 + "║")
+            logger.debug("╚" + "═"*48 + "╝")
+
+            if tool_calls:
+                logger.debug("├─ 🔧 模型决定调用工具:")
+                for i, tool_call in enumerate(tool_calls):
+                    logger.debug("│  %d. %s", i + 1, _format_tool_call(tool_call))
+            elif response.content:
+                logger.debug("├─ 💬 模型文本响应:")
+                logger.debug("│  " + response.content.replace('\n', '\n│  '))
+            else:
+                logger.debug("├─ ⚠️ 模型响应为空（无内容且无工具调用）")
 
-        # 更新状态 - 只返回新消息，框架会自动追加历史消息
-        new_state: AgentState = {
+            # 检查是否需要继续迭代
+            if tool_calls:
+                logger.debug("└─ 🔄 将执行 %d 个工具调用", len(tool_calls))
+            else:
+                logger.debug("└─ ✅ 模型没有调用工具，准备完成任务")
+
+        # 只返回增量：run() 的主循环把新消息原地追加到 state 上
+        return {
             "messages": [response],
-            "iteration_count": state["iteration_count"] + 1,
-            "max_iterations": state["max_iterations"]
+            "iteration_count": state.iteration_count + 1
         }
-        
-        return new_state
-    
-    async def _action_node(self, state: AgentState) -> AgentState:
-        """执行工具调用"""
+
+    def _make_get_blob_tool(self) -> BaseTool:
+        """构建从暂存区按片段取回大结果的工具（闭包持有本实例的暂存区）"""
+        from langchain_core.tools import tool as tool_decorator
+
+        blob_store = self._blob_store
+
+        @tool_decorator
+        def get_blob(uid: str, start: int = 0, end: int = 2000) -> str:
+            """按字符区间 [start, end) 读取暂存的大体积工具结果片段"""
+            content = blob_store.get(uid)
+            if content is None:
+                return f"未找到暂存结果: {uid}"
+            return content[start:end]
+
+        return get_blob
+
+    def _maybe_offload(self, content: str) -> str:
+        """超过阈值的工具结果移入暂存区，只回灌引用与开头预览
+
+        完整的 300 行读表结果若直接进历史，会在之后每一轮 prefill 里重复
+        付费；换成短引用后，模型按需用 get_blob 取片段即可。
+        """
+        if len(content) <= _BLOB_THRESHOLD:
+            return content
+        import uuid
+
+        uid = uuid.uuid4().hex[:12]
+        self._blob_store[uid] = content
+        return (
+            f"[结果过大（{len(content)} 字符），已暂存为 uid={uid}，"
+            f"需要详情时调用 get_blob(uid, start, end) 按片段读取]\n"
+            f"开头预览：\n{content[:500]}"
+        )
+
+    @staticmethod
+    def _compact_messages(msgs: List[BaseMessage]) -> List[BaseMessage]:
+        """压缩滑动窗口之外的大工具结果，把每轮 prefill 成本压到近似常量
+
+        不压缩时，300 行的读表结果会在后续每一轮迭代里被完整重新 prefill，
+        总开销随轮数平方增长。最近 _COMPACT_KEEP_LAST 条消息保持原文
+        （模型当前推理真正依赖的内容），更早的 ToolMessage 只保留首尾片段
+        和截断说明。只改发给 LLM 的副本，state 中的完整结果不受影响。
+        """
+        keep_from = len(msgs) - _COMPACT_KEEP_LAST
+        if keep_from <= 0:
+            return msgs
+        out: List[BaseMessage] = list(msgs)
+        for i in range(keep_from):
+            msg = out[i]
+            if not isinstance(msg, ToolMessage):
+                continue
+            content = msg.content
+            if not isinstance(content, str) or len(content) <= _COMPACT_HEAD + _COMPACT_TAIL + 100:
+                continue
+            truncated = len(content) - _COMPACT_HEAD - _COMPACT_TAIL
+            out[i] = ToolMessage(
+                content=(
+                    content[:_COMPACT_HEAD]
+                    + f"\n…[历史工具结果已截断 {truncated} 字符，保留首尾各 {_COMPACT_HEAD} 字符]…\n"
+                    + content[-_COMPACT_TAIL:]
+                ),
+                tool_call_id=msg.tool_call_id,
+            )
+        return out
+
+    def _try_dispatch_early(self, state: AgentState, acc: Any,
+                            completed_before: Optional[int] = None) -> None:
+        """流式解码期间提前调度已闭合的工具调用
+
+        某个 tool_call 的参数 JSON 只有在更大的 index 出现（或流结束）后才确定闭合。
+        闭合即下发 ainvoke 任务，_action_node 轮到它时直接认领结果。
+        """
+        if acc is None:
+            return
+        # 按 index 聚合分片
+        groups: Dict[int, Dict[str, Any]] = {}
+        for c in getattr(acc, 'tool_call_chunks', None) or []:
+            idx = c.get('index') or 0
+            group = groups.setdefault(idx, {'name': '', 'args': '', 'id': None})
+            if c.get('name'):
+                group['name'] += c['name']
+            if c.get('args'):
+                group['args'] += c['args']
+            if c.get('id'):
+                group['id'] = c['id']
+
+        for idx, group in groups.items():
+            if completed_before is not None and idx >= completed_before:
+                continue  # 该调用的参数可能还在生成中
+            call_id = group['id']
+            if not call_id or call_id in state.early_tool_tasks:
+                continue
+            tool = self._tools_by_name.get(group['name'])
+            if tool is None:
+                continue
+            try:
+                args = _json_loads(group['args']) if group['args'] else {}
+            except ValueError:
+                continue  # 参数不是合法 JSON，交回正常路径处理
+            task = asyncio.create_task(tool.ainvoke(args))
+            state.early_tool_tasks[call_id] = task
+            # 同时按 工具名+参数 注册：个别后端会重写 tool_call id，
+            # 按参数精确匹配仍能认领；重复 await 已完成的任务是安全的
+            state.spec_tasks.setdefault(self._spec_key(group['name'], args), task)
+
+    # 不同 MCP 服务器的读表工具参数名不尽相同，按别名启发式匹配工具 schema
+    @staticmethod
+    def _spec_key(name: str, args: Dict[str, Any]) -> str:
+        """投机任务索引键：工具名 + 规范化参数（键只需内部一致，两个分支不混用）"""
+        if orjson is not None:
+            return name + "|" + orjson.dumps(args, option=orjson.OPT_SORT_KEYS).decode()
+        return f"{name}|{json.dumps(args, sort_keys=True, ensure_ascii=False)}"
+
+    def _parse_read_call(self, query: str, speculative_tool: Optional[str],
+                         require_range: bool = False) -> Optional[tuple]:
+        """从查询文本确定性解析出首个读表调用的 (工具, 参数)
+
+        解析逻辑在 read_call_parser 模块里与 langgraph 变体共用；
+        解析成功时返回 (tool, args)，否则返回 None。
+        """
+        tool = self._tools_by_name.get(speculative_tool or "")
+        if tool is None:
+            return None
+        args = parse_read_call(query, tool, require_range=require_range)
+        if args is None:
+            return None
+        return tool, args
+
+    def _speculate(self, state: AgentState, query: str) -> None:
+        """根据查询文本预判首个读表调用并提前下发
+
+        首轮 LLM 几乎总是先读用户点名的表格区间；命中时后续调度直接认领结果，
+        把工具延迟藏进 LLM 解码时间里。未命中的任务会在收尾时取消，代价接近零。
+        """
+        parsed = self._parse_read_call(query, state.speculative_tool)
+        if parsed is None:
+            return
+        tool, args = parsed
+
+        key = self._spec_key(tool.name, args)
+        if key not in state.spec_tasks:
+            logger.debug("🔮 投机预取: %s(%s)", tool.name, args)
+            state.spec_tasks[key] = asyncio.create_task(tool.ainvoke(args))
+
+    def _try_direct_tool(self, query: str,
+                         speculative_tool: Optional[str]) -> Optional[AIMessage]:
+        """查询能完整解析为单个读表调用时，合成 AIMessage 直接跳过首轮 LLM
+
+        首轮 LLM 的唯一产出本来就是这个 tool_call；确定性解析命中时省掉
+        一整轮 prefill+decode。解析不完整则返回 None，照常走 LLM——
+        包括行列区间放不进工具 schema 的情况：区间丢了等于合成整表读取，
+        与用户点名的范围不符，不能直通。
+        """
+        parsed = self._parse_read_call(query, speculative_tool, require_range=True)
+        if parsed is None:
+            return None
+        tool, args = parsed
+        import uuid
+
+        return AIMessage(content="", tool_calls=[{
+            "name": tool.name,
+            "args": args,
+            "id": f"direct_{uuid.uuid4().hex[:8]}",
+            "type": "tool_call",
+        }])
+
+    async def _dispatch_tool_call(self, state: AgentState, tool_call: Dict[str, Any]) -> Any:
+        """调用单个工具：优先认领提前下发的任务，否则按名称 O(1) 查找后调用"""
+        early_task = state.early_tool_tasks.pop(tool_call.get('id') or '', None)
+        if early_task is not None:
+            return await early_task
+        # 投机任务按 工具名+参数 精确匹配
+        spec_task = state.spec_tasks.pop(
+            self._spec_key(tool_call['name'], tool_call.get('args', {})), None)
+        if spec_task is not None:
+            logger.debug("🎯 投机预取命中: %s", tool_call['name'])
+            return await spec_task
+        tool = self._tools_by_name[tool_call['name']]
+        return await tool.ainvoke(tool_call.get('args', {}))
+
+    async def _action_node(self, state: AgentState) -> Dict[str, Any]:
+        """执行工具调用（同一轮的多个调用并发执行）"""
         # 打印历史消息条数
-        print("\n" + "▼"*30 + " 工具执行区域 " + "▼"*30)
-        print(f"📊 当前历史消息数量: {len(state['messages'])}")
-        print("─"*75)
+        logger.debug("\n" + "▼"*30 + " 工具执行区域 " + "▼"*30)
+        logger.debug("📊 当前历史消息数量: %d", len(state.messages))
+        logger.debug("─"*75)
+
+        last_message = state.messages[-1]
 
-        last_message = state["messages"][-1]
-        
         # 检查工具调用
         tool_calls = getattr(last_message, 'tool_calls', None)
         if tool_calls:
-            print(f"\n🛠️ 开始执行 {len(tool_calls)} 个工具调用...")
-            for i, tool_call in enumerate(tool_calls):
-                tool_name = tool_call.get('name', 'unknown')
-                print(f"  📋 执行工具 {i+1}: {tool_name}")
-            
-            # 使用 ToolNode 异步执行工具调用
-            tool_result = await self.tool_node.ainvoke(state)
-            
-            # 只打印工具执行的摘要信息
-            if isinstance(tool_result, dict) and "messages" in tool_result:
-                print(f"✅ 工具执行完成，返回 {len(tool_result['messages'])} 条消息")
-                
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("\n🛠️ 开始并发执行 %d 个工具调用...", len(tool_calls))
+                for i, tool_call in enumerate(tool_calls):
+                    logger.debug("  📋 执行工具 %d: %s", i + 1, _format_tool_call(tool_call))
+
+            # 并发调度：总耗时从各工具耗时之和降为最大值（MCP 调用以 I/O 为主）；
+            # return_exceptions 保证单个工具失败不拖垮同一轮的其他调用
+            results = await asyncio.gather(
+                *(self._dispatch_tool_call(state, tc) for tc in tool_calls),
+                return_exceptions=True
+            )
+
+            # 按原始顺序包装为 ToolMessage；异常以文本形式回传给模型自行处理
+            tool_messages = [
+                ToolMessage(
+                    content=(
+                        f"工具调用失败: {type(result).__name__}: {result}"
+                        if isinstance(result, BaseException)
+                        else self._maybe_offload(_dump_tool_content(result))
+                    ),
+                    tool_call_id=tc.get('id', ''),
+                    name=tc.get('name')
+                )
+                for tc, result in zip(tool_calls, results)
+            ]
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("✅ 工具执行完成，返回 %d 条消息", len(tool_messages))
+
                 # 分析工具返回结果的摘要
-                for i, msg in enumerate(tool_result["messages"]):
-                    if hasattr(msg, 'content') and msg.content:
+                for i, msg in enumerate(tool_messages):
+                    if msg.content:
                         content_length = len(msg.content)
                         # 如果内容很长，只显示摘要
                         if content_length > 200:
-                            print(f"  📄 工具消息 {i+1}: {content_length} 字符 (内容较长，已省略详情)")
+                            logger.debug("  📄 工具消息 %d: %d 字符 (内容较长，已省略详情)", i + 1, content_length)
                         else:
-                            print(f"  📄 工具消息 {i+1}: {msg.content}")
-                
-                # 只返回工具执行产生的新消息，框架会自动追加历史消息
-                new_state: AgentState = {
-                    "messages": tool_result["messages"],
-                    "iteration_count": state["iteration_count"],
-                    "max_iterations": state["max_iterations"]
-                }
-                
-                print("▲"*30 + " 工具执行完成 " + "▲"*30)
-                return new_state
-            else:
-                # 如果工具执行结果格式不对，保持原状态
-                print("⚠️ 工具执行结果格式异常，保持原状态")
-                print("▲"*30 + " 工具执行异常 " + "▲"*30)
-                return state
+                            logger.debug("  📄 工具消息 %d: %s", i + 1, msg.content)
+
+                logger.debug("▲"*30 + " 工具执行完成 " + "▲"*30)
+            # 只返回工具执行产生的新消息，由主循环原地追加，
+            # 避免 state["messages"] + tool_messages 式的整表拷贝（对话越长拷贝越贵）
+            return {"messages": tool_messages}
         else:
-            print("❌ 没有找到工具调用")
-            print("▲"*30 + " 无工具调用 " + "▲"*30)
-            return state
+            logger.debug("❌ 没有找到工具调用")
+            logger.debug("▲"*30 + " 无工具调用 " + "▲"*30)
+            return {}
     
     async def _finish_node(self, state: AgentState) -> Dict[str, Any]:
         """完成节点"""
-        print("\n🎉 工作流执行完成！")
-        
-        # 从最后一条AI消息中获取最终答案
+        logger.debug("\n🎉 工作流执行完成！")
+
+        # 取消未被认领的提前调度/投机任务（例如模型最终没有采用的调用）
+        for task in state.early_tool_tasks.values():
+            task.cancel()
+        state.early_tool_tasks.clear()
+        for task in state.spec_tasks.values():
+            task.cancel()
+        state.spec_tasks.clear()
+
+        # 终态消息的下标在追加时已记录，这里 O(1) 取用即可
         final_answer = "任务已完成"
-        if state["messages"]:
-            # 从后往前查找最后一条AI消息（不包含工具调用的）
-            for message in reversed(state["messages"]):
-                if (isinstance(message, AIMessage) and 
-                    hasattr(message, 'content') and 
-                    message.content and 
-                    not getattr(message, 'tool_calls', None)):
-                    final_answer = message.content
-                    print(f"✅ 成功提取最终分析报告 ({len(final_answer)} 字符)")
-                    break
-        
+        idx = state.last_terminal_idx
+        if idx is not None:
+            final_answer = state.messages[idx].content
+            logger.debug("✅ 成功提取最终分析报告 (%d 字符)", len(final_answer))
+
+        state.final_answer = final_answer
         return {"final_answer": final_answer}
     
     def _should_continue(self, state: AgentState) -> str:
         """决定是否继续执行"""
-        print("\n" + "◆"*25 + " 流程决策点 " + "◆"*25)
-        print("🔍 Agent决定是否继续执行...")
-        
+        logger.debug("\n" + "◆"*25 + " 流程决策点 " + "◆"*25)
+        logger.debug("🔍 Agent决定是否继续执行...")
+
         # 检查迭代次数
-        if state["iteration_count"] >= state["max_iterations"]:
-            print(f"⚠️ 达到最大迭代次数 ({state['max_iterations']})，结束工作流")
-            print("◆"*60)
+        if state.iteration_count >= state.max_iterations:
+            logger.debug("⚠️ 达到最大迭代次数 (%d)，结束工作流", state.max_iterations)
+            logger.debug("◆"*60)
             return "finish"
-        
+
         # 检查最后一条消息是否包含工具调用
-        if state["messages"]:
-            last_message = state["messages"][-1]
+        if state.messages:
+            last_message = state.messages[-1]
             tool_calls = getattr(last_message, 'tool_calls', None)
             if tool_calls:
-                print(f"🔄 继续下一步：执行 {len(tool_calls)} 个工具调用")
-                print("◆"*60)
+                logger.debug("🔄 继续下一步：执行 %d 个工具调用", len(tool_calls))
+                logger.debug("◆"*60)
                 return "continue"
-        
+
         # 如果没有工具调用，则完成
-        print(f"✅ 模型已完成分析，准备结束工作流")
-        print("◆"*60)
+        logger.debug("✅ 模型已完成分析，准备结束工作流")
+        logger.debug("◆"*60)
         return "finish"
     
-    async def run(self, query: str, max_iterations: int = 10) -> str:
+    @staticmethod
+    def _plan_to_levels(plan: List[Dict[str, Any]]) -> List[List[int]]:
+        """把带 depends_on 的计划按拓扑层次分组，同层内的调用可并发"""
+        levels: Dict[int, int] = {}
+
+        def level_of(i: int, visiting: frozenset = frozenset()) -> int:
+            if i in visiting:
+                raise ValueError(f"计划存在循环依赖: {i}")
+            if i in levels:
+                return levels[i]
+            deps = [d for d in (plan[i].get("depends_on") or [])
+                    if isinstance(d, int) and 0 <= d < len(plan) and d != i]
+            lv = 0 if not deps else 1 + max(level_of(d, visiting | {i}) for d in deps)
+            levels[i] = lv
+            return lv
+
+        for i in range(len(plan)):
+            level_of(i)
+
+        grouped: List[List[int]] = [[] for _ in range(max(levels.values()) + 1)]
+        for i, lv in levels.items():
+            grouped[lv].append(i)
+        return grouped
+
+    async def _plan(self, query: str) -> List[Dict[str, Any]]:
+        """请求 LLM 一次性产出工具调用 DAG；解析失败时返回空计划"""
+        tools_desc = "\n".join(f"- {t.name}: {t.description}" for t in self.tools)
+        planner_msg = SystemMessage(content=_PLANNER_PROMPT.replace("{tools}", tools_desc))
+        response = await self.llm.ainvoke([planner_msg, HumanMessage(content=query)])
+
+        text = (response.content or "").strip()
+        # 容忍 ```json ... ``` 代码块包裹
+        if text.startswith("```"):
+            text = text.strip("`")
+            if text.startswith("json"):
+                text = text[4:]
+        try:
+            plan = _json_loads(text)
+        except ValueError:
+            return []
+        if not isinstance(plan, list):
+            return []
+        # 所有工具名必须可解析，否则放弃计划
+        if not all(isinstance(s, dict) and s.get("tool") in self._tools_by_name for s in plan):
+            return []
+        return plan
+
+    async def _run_planned(self, query: str, plan: List[Dict[str, Any]]) -> str:
+        """按拓扑层次并发执行计划，再用一次 LLM 调用汇总结果"""
+        try:
+            groups = self._plan_to_levels(plan)
+        except ValueError as e:
+            logger.debug("⚠️ 计划无效（%s），回退到 ReAct 流程", e)
+            return ""
+
+        results: Dict[int, str] = {}
+        for group in groups:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("⚡ 并发执行计划步骤: %s", [plan[i]['tool'] for i in group])
+            outputs = await asyncio.gather(
+                *(self._tools_by_name[plan[i]["tool"]].ainvoke(plan[i].get("args") or {})
+                  for i in group),
+                return_exceptions=True
+            )
+            for i, output in zip(group, outputs):
+                if isinstance(output, BaseException):
+                    results[i] = f"工具调用失败: {type(output).__name__}: {output}"
+                else:
+                    results[i] = _dump_tool_content(output)
+
+        # 汇总：一次 LLM 调用生成最终报告
+        summary = "\n\n".join(
+            f"[步骤{i}] {plan[i]['tool']}({plan[i].get('args') or {}}):\n{results[i]}"
+            for i in range(len(plan))
+        )
+        response = await self.llm.ainvoke([
+            self._system_message,
+            HumanMessage(content=query),
+            HumanMessage(content=f"以下是按计划执行工具得到的全部结果，请据此给出最终分析报告：\n\n{summary}")
+        ])
+        return response.content or ""
+
+    async def run(self, query: str, max_iterations: int = 10, use_planner: bool = False,
+                  speculative_tool: Optional[str] = None) -> str:
         """运行工作流"""
-        print("🚀 启动 Excel 分析工作流...")
-        print(f"📋 用户查询: {query}\n")
-        
-        # 初始化状态
-        initial_state: AgentState = {
-            "messages": [HumanMessage(content=query)],
-            "iteration_count": 0,
-            "max_iterations": max_iterations,
-        }
-        
-        # 运行工作流
-        final_state = await self.workflow.ainvoke(initial_state)
-        
-        # 从最终状态中提取最后的AI分析报告
-        final_answer = "工作流执行完成"
-        if "messages" in final_state and final_state["messages"]:
-            # 从后往前查找最后一条AI消息（不包含工具调用的）
-            for message in reversed(final_state["messages"]):
-                if (isinstance(message, AIMessage) and 
-                    hasattr(message, 'content') and 
-                    message.content and 
-                    not getattr(message, 'tool_calls', None)):
-                    final_answer = message.content
-                    print(f"✅ 成功提取最终分析报告 ({len(final_answer)} 字符)")
-                    break
-        
-        return final_answer
-
-
-async def main():
+        logger.debug("🚀 启动 Excel 分析工作流...")
+        logger.debug("📋 用户查询: %s\n", query)
+
+        # 每次运行独享的状态（含提前调度/投机任务表，并发 run() 互不串扰）
+        state = AgentState(
+            messages=[HumanMessage(content=query)],
+            max_iterations=max_iterations,
+            speculative_tool=speculative_tool,
+        )
+
+        # 确定性直通优先：查询能完整解析为单个读表调用时，首轮 LLM 整个省掉；
+        # 只解析出部分信息时退而求其次，做投机预取
+        direct_msg = self._try_direct_tool(query, speculative_tool) if speculative_tool else None
+        if direct_msg is None and speculative_tool:
+            self._speculate(state, query)
+
+        # 规划模式：一次 LLM 调用产出 DAG，独立工具调用并发执行；
+        # 计划为空或执行失败时回退到下面的 ReAct 工作流
+        if use_planner:
+            plan = await self._plan(query)
+            if plan:
+                logger.debug("🗺️ 规划器产出 %d 步计划", len(plan))
+                answer = await self._run_planned(query, plan)
+                if answer:
+                    # 计划路径不经过 _finish_node，这里收掉本次运行的投机任务
+                    for task in state.spec_tasks.values():
+                        task.cancel()
+                    state.spec_tasks.clear()
+                    return answer
+            logger.debug("↩️ 规划器未产出可用计划，回退到 ReAct 工作流")
+
+        # 直通命中：合成的 tool_call 直接进工具执行，再交给主循环继续
+        if direct_msg is not None:
+            logger.debug("⚡ 直通模式：跳过首轮 LLM，直接执行 %s",
+                         direct_msg.tool_calls[0]['name'])
+            state.messages.append(direct_msg)
+            delta = await self._action_node(state)
+            state.messages.extend(delta.get("messages", ()))
+
+        # 手写主循环代替 StateGraph：三个节点的线性循环不需要图引擎的
+        # 状态通道合并与条件边分发。消息增量原地 extend（摊还 O(1)），
+        # 不做 state["messages"] + delta 式的整表重建；历史窗口的控制
+        # 交给 _compact_messages，不用 deque(maxlen) 硬丢旧消息——那会
+        # 截断成对的 tool_call/ToolMessage，导致后端直接拒绝请求
+        while True:
+            delta = await self._agent_node(state)
+            state.messages.extend(delta["messages"])
+            state.iteration_count = delta["iteration_count"]
+
+            # 追加时就知道这条响应是不是终态（有内容、无工具调用），
+            # 顺手记下下标，收尾时不用再反向扫描整条历史
+            response = state.messages[-1]
+            if response.content and not getattr(response, 'tool_calls', None):
+                state.last_terminal_idx = len(state.messages) - 1
+
+            if self._should_continue(state) != "continue":
+                break
+
+            delta = await self._action_node(state)
+            state.messages.extend(delta.get("messages", ()))
+
+        # 最终答案由 _finish_node 提取一次并写入 state，这里只读取
+        await self._finish_node(state)
+        return state.final_answer or "任务已完成"
+
+    async def run_batch(self, queries: List[str], max_iterations: int = 10) -> List[str]:
+        """并发运行多条查询，摊薄 MCP session 建立与工具加载的一次性开销
+
+        每条查询的 state（含提前调度/投机任务表）都在 run() 内部构建，
+        互不共享——一条查询收尾取消任务只影响它自己；LLM 绑定与工具映射
+        是只读的，可以安全地被多个并发 run() 复用。
+        """
+        return list(await asyncio.gather(
+            *(self.run(q, max_iterations=max_iterations) for q in queries)
+        ))
+
+
+async def main(queries_file: Optional[str] = None):
     """主函数：使用自定义工作流的 Excel 代理"""
-    
+    # 延迟导入：这些依赖只有真正运行代理时才需要，避免 import 本模块就付出整个导入链的开销
+    from langchain_mcp_adapters.client import MultiServerMCPClient
+
+    # 配置 verbose=true 时打开本模块的 DEBUG 输出（不影响三方库的日志级别）
+    if get_agent_config().get("verbose", True):
+        logging.basicConfig(format="%(message)s")
+        logger.setLevel(logging.DEBUG)
+
     # 1. 使用配置加载器设置 MCP 客户端
     client = MultiServerMCPClient(get_mcp_client_config())
-    
+
     try:
-        # 2. 使用配置加载器获取模型配置并初始化 LLM
+        # 2. 获取共享的 LLM 实例（模块级单例，复用 httpx 连接池）
         # 使用默认模型 qwen2.5-32B
-        set_model = "qwen2.5-32B"
-        model_config = get_model_service_config(set_model)
-        model = get_model_name(set_model)
-        llm = ChatOpenAI(
-            base_url=model_config["base_url"],
-            api_key=SecretStr(model_config["api_key"]),
-            model=model,
-            temperature=model_config.get("temperature", 0)
-        )
-        
+        llm = get_llm("qwen2.5-32B")
+
         # 3. 使用 session 加载 MCP 工具
         async with client.session("excel") as session:
-            tools = await load_mcp_tools(session)
+            tools = await load_mcp_tools_cached(session, get_mcp_server_config()["url"])
             print(f"🔧 从Ecel MCP server加载了 {len(tools)} 个工具: {[tool.name for tool in tools]}")
             
             # 4. 创建自定义工作流代理
-            agent = ExcelWorkflowAgent(llm, tools)
-            
-            # 5. 执行查询
+            agent_cfg = get_agent_config()
+            agent = ExcelWorkflowAgent(
+                llm, tools, strict_tools=agent_cfg.get("strict_tools", False)
+            )
+
+            # 5. 批量模式：同一个 session / 工具绑定跑完文件中的所有查询
+            if queries_file:
+                with open(queries_file, encoding="utf-8") as f:
+                    queries = [line.strip() for line in f if line.strip()]
+                print(f"📦 批量模式：共 {len(queries)} 条查询")
+                results = await agent.run_batch(
+                    queries, max_iterations=agent_cfg.get("max_iterations", 10)
+                )
+                for query, result in zip(queries, results):
+                    print("\n" + "★"*20 + " 最终回答 " + "★"*20)
+                    print(f"📋 查询: {query}")
+                    print(result)
+                    print("★"*60)
+                return
+
+            # 6. 单条查询：使用配置中的参数运行工作流并获取结果
             input_query = (
                 "读取 20250703it.xlsx 的 Sheet1，前300行 A 到 D 列，"
                 "请分析用户主要关注哪些问题，并给出一份统计分析报告。"
             )
-            
-            # 6. 使用配置中的参数运行工作流并获取结果
-            agent_cfg = get_agent_config()
-            result = await agent.run(input_query, max_iterations=agent_cfg.get("max_iterations", 10))
-            
+            result = await agent.run(
+                input_query,
+                max_iterations=agent_cfg.get("max_iterations", 10),
+                use_planner=agent_cfg.get("use_planner", False),
+                speculative_tool=agent_cfg.get("speculative_read_tool")
+            )
+
             print("\n" + "★"*20 + " 最终回答 " + "★"*20)
             print(result)
             print("★"*60)
@@ -351,5 +780,11 @@ async def main():
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="自定义工作流 Excel Agent")
+    parser.add_argument("--queries-file", help="批量查询文件，每行一条查询，共享同一个 MCP session")
+    args = parser.parse_args()
+
     print("📊 自定义工作流 Excel Agent 启动中...")
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main(queries_file=args.queries_file)) 
\ No newline at end of file
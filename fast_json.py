@@ -0,0 +1,35 @@
+"""
+JSON 编解码的统一入口
+可用时走 orjson（C 实现，解析/序列化大的 Excel 负载比 stdlib 快数倍、
+分配更少），缺省回退 stdlib json。orjson.JSONDecodeError 是 ValueError
+子类，调用方的异常处理不受影响；dumps 统一返回 str。
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj: Any, default=str) -> str:
+        """序列化为 JSON 文本（不可序列化对象经 default 兜底）"""
+        return orjson.dumps(obj, default=default).decode()
+
+    def dumps_sorted(obj: Any, default=str) -> str:
+        """键排序的序列化（用于内容寻址的缓存键等需要规范形态的场景）"""
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS, default=default).decode()
+else:
+    loads = json.loads
+
+    def dumps(obj: Any, default=str) -> str:
+        """序列化为 JSON 文本（不可序列化对象经 default 兜底）"""
+        return json.dumps(obj, ensure_ascii=False, default=default)
+
+    def dumps_sorted(obj: Any, default=str) -> str:
+        """键排序的序列化（用于内容寻址的缓存键等需要规范形态的场景）"""
+        return json.dumps(obj, ensure_ascii=False, sort_keys=True, default=default)
@@ -0,0 +1,75 @@
+"""
+MCP 工具列表缓存加载器
+按服务器 URL 区分的两级缓存——进程内 TTL 缓存（命中时零 I/O）+ 磁盘缓存
+（跨进程复用）。缓存的是原始工具 schema，BaseTool 每次都针对当前 session
+重建，不会持有已关闭的旧 session。
+"""
+import os
+from typing import Dict, List
+
+from langchain_core.tools import BaseTool
+
+_TOOLS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "excel_agent")
+_TOOLS_CACHE_TTL = 3600
+_TOOLS_MEM_CACHE: Dict[str, tuple] = {}  # url -> (过期时间戳, 原始 schema 列表)
+_TOOLS_MEM_TTL = 300
+
+
+async def load_mcp_tools_cached(session, url: str) -> List[BaseTool]:
+    """加载 MCP 工具列表（带内存/磁盘两级缓存，省掉 tools/list 网络往返）"""
+    import hashlib
+    import pickle
+    import time
+    from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+    from mcp.types import Tool as MCPTool
+
+    def _rebuild(raw):
+        return [
+            convert_mcp_tool_to_langchain_tool(session, MCPTool.model_validate(d))
+            for d in raw
+        ]
+
+    now = time.time()
+
+    # 第一级：进程内缓存（同进程内重复加载时连磁盘都不碰）
+    cached = _TOOLS_MEM_CACHE.get(url)
+    if cached is not None and now < cached[0]:
+        return _rebuild(cached[1])
+
+    cache_path = os.path.join(
+        _TOOLS_CACHE_DIR, f"tools_{hashlib.sha1(url.encode()).hexdigest()}.pkl"
+    )
+
+    # 第二级：磁盘缓存新鲜时直接用缓存的 schema 重建工具
+    try:
+        if now - os.path.getmtime(cache_path) < _TOOLS_CACHE_TTL:
+            with open(cache_path, 'rb') as f:
+                raw = pickle.load(f)
+            _TOOLS_MEM_CACHE[url] = (now + _TOOLS_MEM_TTL, raw)
+            return _rebuild(raw)
+    except Exception:
+        pass  # 缓存缺失/损坏时回退到正常加载
+
+    # 缓存未命中：走 tools/list（带分页），并把原始 schema 写回两级缓存
+    mcp_tools = []
+    cursor = None
+    while True:
+        result = await session.list_tools(cursor=cursor)
+        mcp_tools.extend(result.tools)
+        cursor = getattr(result, "nextCursor", None)
+        if not cursor:
+            break
+
+    raw = [t.model_dump() for t in mcp_tools]
+    _TOOLS_MEM_CACHE[url] = (now + _TOOLS_MEM_TTL, raw)
+
+    try:
+        os.makedirs(_TOOLS_CACHE_DIR, exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(raw, f, protocol=5)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+    return [convert_mcp_tool_to_langchain_tool(session, t) for t in mcp_tools]
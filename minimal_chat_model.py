@@ -0,0 +1,124 @@
+"""
+直连 /v1/chat/completions 的轻量流式聊天模型
+绕开 ChatOpenAI 每个 token 的回调分发、Pydantic 分片校验等 Python 层
+开销：一条 httpx SSE 流 + orjson（缺省回退 stdlib json）紧循环解析，
+每个 delta 只构造一个 AIMessageChunk。仅实现异步流式热路径，
+工具通过 bind_tools 一次性序列化成 OpenAI tools 载荷。
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import AIMessageChunk, BaseMessage, convert_to_openai_messages
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# SSE 逐行解析走统一的 fast_json 入口（可用时为 orjson）
+from fast_json import loads as _json_loads
+
+
+class MinimalChatModel(BaseChatModel):
+    """OpenAI 兼容接口的最小异步流式实现
+
+    与 ChatOpenAI 的行为差异：只支持异步接口（同步 invoke 未实现；
+    ainvoke/abatch 内部走流式聚合）、不做逐分片 Pydantic 校验、
+    不走回调管理器之外的任何中间层。
+    工具调用分片按 OpenAI delta 协议原样转成 tool_call_chunks，
+    由 LangChain 的分片累加逻辑在下游聚合。
+    """
+
+    base_url: str
+    api_key: str = "dummy"
+    model: str
+    temperature: float = 0
+    http_async_client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "minimal-openai-chat"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        """把工具一次性序列化成 OpenAI tools 载荷后绑定
+
+        序列化只发生在这里；后续每轮 ainvoke/astream 直接复用现成的
+        载荷字典，不再重复做 Pydantic→dict 转换。
+        """
+        payload = [convert_to_openai_tool(t) for t in tools]
+        return self.bind(tools=payload, **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError(
+            "MinimalChatModel 只支持异步调用（ainvoke/astream/abatch）；"
+            "同步场景请改用 ChatOpenAI"
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        """非流式异步入口（ainvoke/abatch）：聚合流式分片成完整结果"""
+        return await agenerate_from_stream(
+            self._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        )
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        body: Dict[str, Any] = {
+            "model": self.model,
+            "messages": convert_to_openai_messages(messages),
+            "temperature": self.temperature,
+            "stream": True,
+        }
+        if stop:
+            body["stop"] = stop
+        tools = kwargs.get("tools")
+        if tools:
+            body["tools"] = tools
+
+        client = self.http_async_client
+        owned = client is None
+        if owned:
+            client = httpx.AsyncClient(timeout=60)
+        try:
+            async with client.stream(
+                "POST",
+                self.base_url.rstrip("/") + "/chat/completions",
+                json=body,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            ) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = _json_loads(data).get("choices")
+                    if not choices:
+                        continue
+                    delta = choices[0].get("delta") or {}
+                    tool_call_chunks = [
+                        {
+                            "name": (tc.get("function") or {}).get("name"),
+                            "args": (tc.get("function") or {}).get("arguments"),
+                            "id": tc.get("id"),
+                            "index": tc.get("index"),
+                            "type": "tool_call_chunk",
+                        }
+                        for tc in delta.get("tool_calls") or []
+                    ]
+                    content = delta.get("content") or ""
+                    if not content and not tool_call_chunks:
+                        continue
+                    chunk = ChatGenerationChunk(message=AIMessageChunk(
+                        content=content, tool_call_chunks=tool_call_chunks
+                    ))
+                    if run_manager is not None and content:
+                        await run_manager.on_llm_new_token(content, chunk=chunk)
+                    yield chunk
+        finally:
+            if owned:
+                await client.aclose()
@@ -0,0 +1,54 @@
+"""
+读表调用的确定性解析器
+从中文查询文本里解析出首个 Excel 读取调用的参数，供各 agent 变体的
+投机预取 / 首轮直通逻辑共用。纯函数、无副作用，import 零成本。
+"""
+import re
+from typing import Any, Dict, Optional
+
+# 把解析出的取值映射到工具实际参数名用的别名表
+SPEC_ARG_ALIASES = {
+    "file": ("filepath", "file_path", "file", "filename", "path"),
+    "sheet": ("sheet_name", "sheet"),
+    "start": ("start_cell", "start", "range_start"),
+    "end": ("end_cell", "end", "range_end"),
+}
+
+
+def parse_read_call(query: str, tool,
+                    require_range: bool = False) -> Optional[Dict[str, Any]]:
+    """从查询文本确定性解析出首个读表调用的参数
+
+    文件名、工作表、行数、列区间全部解析成功且能放进工具 schema 时
+    返回参数字典，否则返回 None。文件/工作表参数放不进 schema 一律放弃；
+    行列区间默认允许放不进（投机预取未命中只是缓存落空），直通替代首轮
+    LLM 的调用方应传 require_range=True——区间丢了会变成整表读取，
+    与用户要求不符，必须回退 LLM。
+    """
+    m_file = re.search(r'(\S+\.xlsx?)', query)
+    m_sheet = re.search(r'(Sheet\w+)', query)
+    m_rows = re.search(r'前\s*(\d+)\s*行', query)
+    m_cols = re.search(r'([A-Za-z])\s*[到至~-]\s*([A-Za-z])\s*列', query, re.IGNORECASE)
+    if not (m_file and m_sheet and m_rows and m_cols):
+        return None
+
+    values = {
+        "file": m_file.group(1),
+        "sheet": m_sheet.group(1),
+        "start": f"{m_cols.group(1).upper()}1",
+        "end": f"{m_cols.group(2).upper()}{m_rows.group(1)}",
+    }
+
+    # 把提取值放进工具实际的参数名里；关键参数放不进去就放弃
+    try:
+        props = set(tool.args.keys())
+    except Exception:
+        return None
+    args: Dict[str, Any] = {}
+    for kind, value in values.items():
+        alias = next((a for a in SPEC_ARG_ALIASES[kind] if a in props), None)
+        if alias is not None:
+            args[alias] = value
+        elif kind in ("file", "sheet") or require_range:
+            return None
+    return args